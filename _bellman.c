@@ -0,0 +1,61 @@
+/* One Gauss-Seidel Bellman sweep over the successor arrays of mdp.MDP, loaded by mdp.py via ctypes.
+ *
+ * Build with:
+ *     cc -O3 -ffast-math -march=native -shared -fPIC -o _bellman.so _bellman.c
+ *
+ * succ_prob and succ_idx are the C-contiguous (num_states, num_actions, 3) arrays of the MDP.
+ * The sweep is the same as _vi_loop in mdp.py: states are visited in the given order and V is
+ * updated in place, so later states already see their neighbours' new values.
+ */
+#include <math.h>
+#include <stddef.h>
+#include <stdint.h>
+
+/* Checked by mdp.py at load time, so a library built from an older version of this file is
+ * ignored instead of called with the wrong arguments.  Bump together with _BELLMAN_ABI_VERSION
+ * in mdp.py whenever the exported functions change. */
+#define BELLMAN_ABI_VERSION 2
+
+int bellman_abi_version(void)
+{
+    return BELLMAN_ABI_VERSION;
+}
+
+/* Set V[s] = R[s] + gamma * max_a sum_k succ_prob * V[succ_idx] for every state s in order
+ * (V[s] = R[s] for terminal states) and write the argmax action into pi.
+ * Returns the largest absolute change of any utility. */
+float bellman_sweep(const float *restrict succ_prob, const int32_t *restrict succ_idx,
+                    const float *restrict R, const uint8_t *restrict term_mask,
+                    const int32_t *restrict order, float *restrict V, int32_t *restrict pi,
+                    int num_states, int num_actions, float gamma)
+{
+    float delta = 0.0f;
+    for (int i = 0; i < num_states; i++) {
+        int s = order[i];
+        float v;
+        if (term_mask[s]) {
+            v = R[s];
+        } else {
+            const float *p = succ_prob + (size_t)s * num_actions * 3;
+            const int32_t *idx = succ_idx + (size_t)s * num_actions * 3;
+            float max_q = p[0] * V[idx[0]] + p[1] * V[idx[1]] + p[2] * V[idx[2]];
+            int32_t best = 0;
+            for (int a = 1; a < num_actions; a++) {
+                p += 3;
+                idx += 3;
+                float q = p[0] * V[idx[0]] + p[1] * V[idx[1]] + p[2] * V[idx[2]];
+                if (q > max_q) {
+                    max_q = q;
+                    best = a;
+                }
+            }
+            v = R[s] + gamma * max_q;
+            pi[s] = best;
+        }
+        float diff = fabsf(v - V[s]);
+        if (diff > delta)
+            delta = diff;
+        V[s] = v;
+    }
+    return delta;
+}
@@ -1,6 +1,46 @@
-from collections import defaultdict
+import ctypes
+import os
 import traceback
 
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+#optional C kernel for one in-place Bellman sweep, see _bellman.c for how to build it.  Bump
+#together with BELLMAN_ABI_VERSION in _bellman.c whenever the exported functions change.
+_BELLMAN_ABI_VERSION = 2
+
+
+def _load_bellman():
+    """Load the C kernel, or return None if it is missing, stale (built from an older
+    _bellman.c) or not ours at all.
+    """
+    try:
+        lib = ctypes.CDLL(os.path.join(os.path.dirname(os.path.abspath(__file__)), '_bellman.so'))
+        lib.bellman_abi_version.restype = ctypes.c_int
+        lib.bellman_abi_version.argtypes = []
+        if lib.bellman_abi_version() != _BELLMAN_ABI_VERSION:
+            return None
+        lib.bellman_sweep.restype = ctypes.c_float
+        lib.bellman_sweep.argtypes = [
+            np.ctypeslib.ndpointer(np.float32, flags='C_CONTIGUOUS'),  # succ_prob
+            np.ctypeslib.ndpointer(np.int32, flags='C_CONTIGUOUS'),    # succ_idx
+            np.ctypeslib.ndpointer(np.float32, flags='C_CONTIGUOUS'),  # R
+            np.ctypeslib.ndpointer(np.bool_, flags='C_CONTIGUOUS'),    # term_mask
+            np.ctypeslib.ndpointer(np.int32, flags='C_CONTIGUOUS'),    # order
+            np.ctypeslib.ndpointer(np.float32, flags='C_CONTIGUOUS'),  # V
+            np.ctypeslib.ndpointer(np.int32, flags='C_CONTIGUOUS'),    # pi
+            ctypes.c_int, ctypes.c_int, ctypes.c_float]
+    except (OSError, AttributeError):
+        return None
+    return lib
+
+
+_bellman = _load_bellman()
+
 
 class MDP():
     """Class for representing a Gridworld MDP.
@@ -33,11 +73,33 @@ class MDP():
             for j in range(num_rows):
                 self.states.append((i+1, j+1))
         self.rewards = rewards
-        self.terminals = terminals
+        self.terminals = frozenset(terminals)
         self.prob_forw = prob_forw
         self.prob_side = (1.0 - prob_forw)/2
         self.reward_def = reward_default
         self.actions = ['up', 'right', 'down', 'left']
+        #flat index of each state, (x, y) -> (x-1)*nrows + (y-1)
+        self.index = dict((s, i) for i, s in enumerate(self.states))
+        #successors of every (state, action) pair as flat arrays (structure of arrays), in single
+        #precision like the rewards and utilities to halve memory traffic in the sweeps:
+        #succ_idx[s, a, k] is the k-th successor of s under a and succ_prob[s, a, k] its
+        #probability.  Unused slots (and all slots of terminal states) point at s itself with
+        #probability 0, so every backup is a fixed-size gather-multiply-sum.
+        num_states = len(self.states)
+        self.R = np.array([self.get_reward(s) for s in self.states], dtype=np.float32)
+        self.term_mask = np.array([self.is_terminal(s) for s in self.states], dtype=bool)
+        self.succ_idx = np.empty((num_states, len(self.actions), 3), dtype=np.int32)
+        self.succ_prob = np.zeros((num_states, len(self.actions), 3), dtype=np.float32)
+        for i, s in enumerate(self.states):
+            self.succ_idx[i] = i
+            for a, action in enumerate(self.actions):
+                for k, (succ, prob) in enumerate(self.get_successor_probs(s, action)):
+                    self.succ_idx[i, a, k] = self.index[succ]
+                    self.succ_prob[i, a, k] = prob
+        #in-place sweeps visit high-reward states (terminals, goals) first so their values propagate
+        self.sweep_order = np.argsort(-self.R, kind='stable')
+        #straight-line sweep generated by compile(), used by value_iteration when set
+        self.compiled_sweep = None
 
     def get_states(self):
         """Return a list of all states as (x, y) tuples."""
@@ -48,36 +110,12 @@ class MDP():
         return self.actions
 
     def get_successor_probs(self, state, action):
-        """Returns a dictionary mapping possible successor states to their transition probabilities
-        for the given state and action.
+        """Returns a tuple of (successor state, transition probability) pairs for the given state
+        and action.
         """
         if self.is_terminal(state):
-            return {}  # we cant move from terminal state since we end
-
-        x, y = state
-        succ_up = (x, min(self.nrows, y+1))
-        succ_right = (min(self.ncols, x+1), y)
-        succ_down = (x, max(1, y-1))
-        succ_left = (max(1, x-1), y)
-
-        succ__prob = defaultdict(float)
-        if action == 'up':
-            succ__prob[succ_up] = self.prob_forw
-            succ__prob[succ_right] += self.prob_side
-            succ__prob[succ_left] += self.prob_side
-        elif action == 'right':
-            succ__prob[succ_right] = self.prob_forw
-            succ__prob[succ_up] += self.prob_side
-            succ__prob[succ_down] += self.prob_side
-        elif action == 'down':
-            succ__prob[succ_down] = self.prob_forw
-            succ__prob[succ_right] += self.prob_side
-            succ__prob[succ_left] += self.prob_side
-        elif action == 'left':
-            succ__prob[succ_left] = self.prob_forw
-            succ__prob[succ_up] += self.prob_side
-            succ__prob[succ_down] += self.prob_side
-        return succ__prob
+            return ()  # we cant move from terminal state since we end
+        return _successor_probs(state, action, self.nrows, self.ncols, self.prob_forw)
 
     def get_reward(self, state):
         """Get the reward for the state, return default if not specified in the constructor."""
@@ -87,62 +125,338 @@ class MDP():
         """Returns True if the given state is a terminal state."""
         return state in self.terminals
 
+    def compile(self):
+        """Generate a Python sweep function specialized to this grid and store it in
+        compiled_sweep.
+
+        The successors, probabilities and rewards are inlined as constants, so one in-place
+        (Gauss-Seidel) sweep over a list of utilities becomes straight-line code with no lookups,
+        wall clamping or allocation.  The function has the signature sweep(V, gamma) and returns
+        the largest change of any utility.  Meant for small grids like the 2x3 test grids; the
+        generated code grows linearly with the number of states.
+        """
+        lines = ["def sweep(V, gamma):", "    delta = 0.0"]
+        for i in self.sweep_order.tolist():
+            s = self.states[i]
+            if self.is_terminal(s):
+                #the utility of a terminal state stays at its reward
+                continue
+            q_values = []
+            for action in self.actions:
+                q_values.append(" + ".join("{!r} * V[{}]".format(float(prob), self.index[succ])
+                                           for succ, prob in self.get_successor_probs(s, action)))
+            lines.append("    v = {!r} + gamma * max({})".format(
+                float(self.get_reward(s)), ", ".join(q_values)))
+            lines.append("    d = abs(v - V[{}])".format(i))
+            lines.append("    if d > delta: delta = d")
+            lines.append("    V[{}] = v".format(i))
+        lines.append("    return delta")
+        namespace = {}
+        exec("\n".join(lines), namespace)
+        self.compiled_sweep = namespace["sweep"]
+        return self.compiled_sweep
+
+
+def _successor_probs(state, action, nrows, ncols, prob_forw):
+    """Successor distribution of a non-terminal state, as a tuple of (successor state,
+    probability) pairs.
+    """
+    prob_side = (1.0 - prob_forw)/2
+    x, y = state
+    succ_up = (x, min(nrows, y+1))
+    succ_right = (min(ncols, x+1), y)
+    succ_down = (x, max(1, y-1))
+    succ_left = (max(1, x-1), y)
+
+    if action == 'up':
+        succ_forw, succ_side1, succ_side2 = succ_up, succ_right, succ_left
+    elif action == 'right':
+        succ_forw, succ_side1, succ_side2 = succ_right, succ_up, succ_down
+    elif action == 'down':
+        succ_forw, succ_side1, succ_side2 = succ_down, succ_right, succ_left
+    elif action == 'left':
+        succ_forw, succ_side1, succ_side2 = succ_left, succ_up, succ_down
+    else:
+        return ()
+
+    #at most three successors; bumping into a wall can make them coincide, so merge duplicates
+    succ_probs = [(succ_forw, prob_forw)]
+    for succ_side in (succ_side1, succ_side2):
+        for i, (succ, prob) in enumerate(succ_probs):
+            if succ == succ_side:
+                succ_probs[i] = (succ, prob + prob_side)
+                break
+        else:
+            succ_probs.append((succ_side, prob_side))
+    return tuple(succ_probs)
 
-def value_iteration(mdp, gamma, epsilon):
+
+def value_iteration(mdp, gamma, epsilon, with_policy=False, symmetry=None, v_init=None,
+                    stats=None):
     """Calculate the utilities for the states of an MDP.
 
+    The greedy action of every state is recorded during the sweeps as well, so the policy comes
+    for free with the final sweep instead of needing a separate derive_policy pass.
+
     Args:
         mdp: An instance of the MDP class defined above, describing the environment
         gamma: the discount factor
         epsilon: the change threshold to use when determining convergence.  The function returns
             when none of the states have a utility whose change from the previous iteration is more
             than epsilon
+        with_policy: if True, also return the policy found by the final sweep
+        symmetry: optional function mapping each state (x, y) tuple to a canonical representative
+            state of the same utility, e.g. (x, y) -> (x, min(y, nrows + 1 - y)) for a grid that
+            is mirrored around its middle row.  Only the canonical states are iterated, and the
+            other states get the utility of their representative.  The mapping must come from an
+            automorphism of the whole MDP, not just of the rewards: equivalent states need equal
+            rewards and terminal flags, and transitions that correspond under the mirroring (up to
+            relabelling the actions).  Representatives must map to themselves.  Only rewards,
+            terminal flags and representatives are checked; a callback that is not an
+            automorphism otherwise gives wrong utilities.
+        v_init: optional dictionary mapping state (x, y) tuples to starting utilities, e.g. the
+            converged utilities of a similar MDP, to warm-start from instead of the rewards
+        stats: optional dictionary; if given, the number of sweeps taken is stored in
+            stats['sweeps']
 
     Returns:
         A python dictionary, with state (x, y) tuples as keys, and converged utilities as values.
+        If with_policy is True, a (utilities, policy) tuple where policy is a dictionary as
+        returned by derive_policy.
+    """
+    #start from the rewards, or from the given utilities (terminal states always hold their reward)
+    if v_init is None:
+        V = mdp.R.copy()
+    else:
+        V = np.array([v_init[s] for s in mdp.states], dtype=np.float32)
+        V[mdp.term_mask] = mdp.R[mdp.term_mask]
+
+    if symmetry is not None:
+        #collapse every class of equivalent states onto its canonical representative
+        canon = np.array([mdp.index[symmetry(s)] for s in mdp.states])
+        reps = np.unique(canon)
+        if not np.array_equal(canon[reps], reps):
+            raise ValueError("symmetry must map every canonical state to itself.")
+        if (not np.array_equal(mdp.R, mdp.R[canon])
+                or not np.array_equal(mdp.term_mask, mdp.term_mask[canon])):
+            raise ValueError("symmetry must map states to states with the same reward and "
+                             "terminal flag.")
+        compact = np.zeros(len(mdp.states), dtype=np.int32)
+        compact[reps] = np.arange(len(reps))
+        class_of = compact[canon]
+        #the reduced MDP: transitions of the representatives, with successors renamed to classes
+        R = mdp.R[reps]
+        V, _, sweeps = _solve(class_of[mdp.succ_idx[reps]], mdp.succ_prob[reps], R,
+                              mdp.term_mask[reps], np.argsort(-R, kind='stable'), V[reps],
+                              gamma, epsilon)
+        if stats is not None:
+            stats['sweeps'] = sweeps
+        V = V[class_of]
+        #actions do not carry over between mirrored states, so take the greedy step on the full grid
+        return _vi_result(mdp, V, _q_values(mdp, V).argmax(axis=1), with_policy)
+
+    if mdp.compiled_sweep is not None:
+        sweep = mdp.compiled_sweep
+        #the generated code works on Python floats, so start from the exact rewards (or v_init)
+        #rather than their float32 copies in V
+        V = [float(mdp.get_reward(s)) if v_init is None or mdp.is_terminal(s) else float(v_init[s])
+             for s in mdp.states]
+        sweeps = 1
+        while sweep(V, gamma) > epsilon:
+            sweeps += 1
+        if stats is not None:
+            stats['sweeps'] = sweeps
+        V = np.array(V)
+        #one greedy step on the converged utilities gives the policy
+        return _vi_result(mdp, V, _q_values(mdp, V).argmax(axis=1), with_policy)
+    V, pi, sweeps = _solve(mdp.succ_idx, mdp.succ_prob, mdp.R, mdp.term_mask, mdp.sweep_order,
+                           V, gamma, epsilon)
+    if stats is not None:
+        stats['sweeps'] = sweeps
+    return _vi_result(mdp, V, pi, with_policy)
+
+
+def _solve(succ_idx, succ_prob, R, term_mask, order, V, gamma, epsilon):
+    """Run value iteration from V over successor arrays laid out like MDP.succ_idx/succ_prob,
+    with the fastest backend available: numba runs the whole loop natively, the C kernel one
+    sweep per call, and both do the same in-place sweeps in the given state order.  The numpy
+    fallback does Jacobi sweeps, which can take a few more sweeps to converge.
+
+    Returns the converged utilities, the index of the best action of each state and the number
+    of sweeps taken.
+    """
+    num_states, num_actions = succ_prob.shape[:2]
+    if _vi_njit is not None:
+        pi = np.zeros(num_states, dtype=np.int64)
+        sweeps = _vi_njit(succ_idx, succ_prob, R, term_mask, order, V, pi, gamma, epsilon)
+        return V, pi, sweeps
+    if _bellman is not None:
+        #hoist the C entry point out of the sweep loop
+        bellman_sweep = _bellman.bellman_sweep
+        order = np.ascontiguousarray(order, dtype=np.int32)
+        pi = np.zeros(num_states, dtype=np.int32)
+        sweeps = 0
+        while True:
+            delta = bellman_sweep(succ_prob, succ_idx, R, term_mask, order, V, pi,
+                                  num_states, num_actions, gamma)
+            sweeps += 1
+            if delta <= epsilon:
+                break
+        return V, pi, sweeps
+    #work buffers reused by every sweep, V and V_new are swapped rather than copied
+    V_new = np.empty_like(V)
+    gathered = np.empty(succ_prob.shape, dtype=np.float32)
+    Q = np.empty((num_states, num_actions), dtype=np.float32)
+    take, copyto = np.take, np.copyto
+    sweeps = 0
+    while True:
+        #expected utility of every (state, action) pair as one gather-multiply-sum
+        take(V, succ_idx, out=gathered)
+        gathered *= succ_prob
+        gathered.sum(axis=-1, out=Q)
+        #apply the formula
+        Q.max(axis=1, out=V_new)
+        V_new *= gamma
+        V_new += R
+        copyto(V_new, R, where=term_mask)
+        #check convergence with a single infinity-norm reduction
+        delta = np.max(np.abs(V_new - V))
+        V, V_new = V_new, V
+        sweeps += 1
+        if delta <= epsilon:
+            break
+    #Q still holds the expected utilities of the final sweep, its argmax is the policy
+    return V, Q.argmax(axis=1), sweeps
+
+
+def _vi_result(mdp, V, pi, with_policy):
+    """Package the utility array (and action indices) the way value_iteration returns them."""
+    utilities = dict(zip(mdp.states, V.tolist()))
+    if with_policy:
+        return utilities, _policy_dict(mdp, pi)
+    return utilities
+
+
+def _q_values(mdp, V):
+    """Return the (nS, nA) array of expected utilities of every state and action under V."""
+    return (mdp.succ_prob * V[mdp.succ_idx]).sum(axis=-1)
+
+
+def _policy_dict(mdp, pi):
+    """Turn an array of action indices into a policy dictionary, with None for terminal states."""
+    policy = {}
+    for s, a, terminal in zip(mdp.states, pi.tolist(), mdp.term_mask.tolist()):
+        policy[s] = None if terminal else mdp.actions[a]
+    return policy
+
+
+def batch_value_iteration(mdps, gammas, epsilon, stats=None):
+    """Calculate the utilities for several MDPs of the same grid shape in one vectorized loop.
+
+    The successor arrays and rewards of all MDPs are stacked along a leading batch axis and every
+    sweep backs up all of them at once, each with its own discount factor.
+
+    Args:
+        mdps: A list of instances of the MDP class, all with the same number of rows and columns
+        gammas: A list with the discount factor of each MDP
+        epsilon: the change threshold to use when determining convergence.  The function returns
+            when none of the states of any MDP have a utility whose change from the previous
+            iteration is more than epsilon
+        stats: optional dictionary; if given, the number of sweeps taken is stored in
+            stats['sweeps']
+
+    Returns:
+        A list with one dictionary per MDP, mapping state (x, y) tuples to converged utilities.
+    """
+    if len(set((mdp.nrows, mdp.ncols) for mdp in mdps)) > 1:
+        raise ValueError("batch_value_iteration needs MDPs that all have the same grid shape.")
+    succ_idx = np.stack([mdp.succ_idx for mdp in mdps])
+    succ_prob = np.stack([mdp.succ_prob for mdp in mdps])
+    R = np.stack([mdp.R for mdp in mdps])
+    term_mask = np.stack([mdp.term_mask for mdp in mdps])
+    gammas = np.asarray(gammas, dtype=np.float32)
+    #row of each gathered successor, so V[batch, succ_idx] picks from the right MDP
+    batch = np.arange(len(mdps))[:, None, None, None]
+
+    V = R.copy()
+    V_new = np.empty_like(V)
+    sweeps = 0
+    while True:
+        Q = (succ_prob * V[batch, succ_idx]).sum(-1)
+        Q.max(axis=-1, out=V_new)
+        V_new *= gammas[:, None]
+        V_new += R
+        np.copyto(V_new, R, where=term_mask)
+        delta = np.max(np.abs(V_new - V))
+        #swap the two buffers instead of copying
+        V, V_new = V_new, V
+        sweeps += 1
+        if delta <= epsilon:
+            break
+    if stats is not None:
+        stats['sweeps'] = sweeps
+    return [dict(zip(mdp.states, utils)) for mdp, utils in zip(mdps, V.tolist())]
+
+
+def _vi_loop(succ_idx, succ_prob, R, term_mask, order, V, pi, gamma, epsilon):
+    """Run value iteration to convergence over the successor arrays of an MDP, updating V in
+    place, and return the number of sweeps taken.
+
+    pi receives the index of the best action of each state in the final sweep.
+
+    Sweeps are Gauss-Seidel: V[s] is overwritten in place, in the given state order, so states
+    later in the sweep already see their neighbours' new values.  Written as plain loops so that
+    numba can compile it into a single native function.
     """
-    utilities = {}
-    updated_utilities = {}
-    #set the minReward as the greatest value
-    min_reward = float("inf")
-    #for each state:
-    for s in mdp.get_states():
-        utilities[s] = mdp.get_reward(s)
-        if utilities[s] < min_reward:
-            #update minReward
-            min_reward = utilities[s]
-    convergence = False
-
-    while not convergence:
-        convergence_val = 0
+    num_actions = succ_idx.shape[1]
+    num_succ = succ_idx.shape[2]
+    sweeps = 0
+    while True:
+        sweeps += 1
+        delta = 0.0
         #for each state:
-        for s in mdp.get_states():
-            temp = utilities[s]
-            max_val = min_reward
-            #for each action:
-            for action in mdp.get_actions(s):
-                #compare the values and update
-                max_val = max(max_val, utility_prob_sum(
-                    mdp.get_successor_probs(s, action), utilities))
+        for s in order:
+            if term_mask[s]:
+                #no successors, the utility is just the reward
+                V[s] = R[s]
+                continue
+            temp = V[s]
+            #seed the best action with action 0 rather than -inf, which fastmath may assume
+            #never occurs
+            max_q = 0.0
+            for k in range(num_succ):
+                max_q += succ_prob[s, 0, k] * V[succ_idx[s, 0, k]]
+            pi[s] = 0
+            #for each other action:
+            for a in range(1, num_actions):
+                #q is a weighted average of the successor utilities, so it cannot beat the best
+                #successor; skip the sum when that bound is no better than the current best
+                #(an unused slot only raises the bound, so it is safe to seed from slot 0)
+                upper = V[succ_idx[s, a, 0]]
+                for k in range(1, num_succ):
+                    if succ_prob[s, a, k] > 0.0 and V[succ_idx[s, a, k]] > upper:
+                        upper = V[succ_idx[s, a, k]]
+                if upper <= max_q:
+                    continue
+                q = 0.0
+                for k in range(num_succ):
+                    q += succ_prob[s, a, k] * V[succ_idx[s, a, k]]
+                if q > max_q:
+                    max_q = q
+                    pi[s] = a
             #apply the formula
-            updated_utilities[s] = (mdp.get_reward(s) + gamma * max_val)
-            #compare the values and update
-            convergence_val = max(convergence_val, abs(
-                temp - updated_utilities[s]))
-        #when iteration is done for all states, update the states' original values
-        for state in updated_utilities.keys():
-            utilities[state] = updated_utilities[state]
-        #check convergence
-        if convergence_val <= epsilon:
-            convergence = True
-    return updated_utilities
-
-
-def utility_prob_sum(prob_state_dict, utility_dict):
-    sum_val = 0
-    for suc, prob in prob_state_dict.items():
-        sum_val += prob * utility_dict[suc]
-    return sum_val
+            V[s] = R[s] + gamma * max_q
+            diff = abs(V[s] - temp)
+            if diff > delta:
+                delta = diff
+        if delta <= epsilon:
+            return sweeps
+
+
+if numba is not None:
+    _vi_njit = numba.njit(cache=True, fastmath=True)(_vi_loop)
+else:
+    _vi_njit = None
 
 
 def derive_policy(mdp, utility):
@@ -157,31 +471,60 @@ def derive_policy(mdp, utility):
         policy: A dictionary mapping state (x, y) tuples to the optimal action for that state (one
             of 'up', 'down', 'left', 'right', or None for terminal states)
     """
-    policy = {}
-    #for each state:
-    for s in mdp.get_states():
-        #check if the state is terminal
-        if mdp.is_terminal(s):
-            policy[s] = None
-        else:
-            best_action = None
-            #assign the lowest value as best_utility
-            best_utility = float('-inf')
-            #for each action:
-            for a in mdp.get_actions(s):
-                #calculate the expected utility(exp_util)
-                exp_util = sum([prob*utility[s_p] for s_p,
-                               prob in mdp.get_successor_probs(s, a).items()])
-                #compare values and update
-                if exp_util > best_utility:
-                    best_utility = exp_util
-                    best_action = a
-            #update the policy of the state with the best action
-            policy[s] = best_action
-    return policy
+    V = np.array([utility[s] for s in mdp.states], dtype=np.float32)
+    #first action wins ties, like max() over the actions in order
+    return _policy_dict(mdp, _q_values(mdp, V).argmax(axis=1))
+
 
+def policy_iteration(mdp, gamma, max_rounds=1000, stats=None):
+    """Calculate the utilities and an optimal policy of an MDP with Howard's policy iteration.
 
-def utils_and_policy(emdeepee, gamma, epsilon):
+    Each round evaluates the current policy exactly by solving the linear system
+    (I - gamma * P_pi) V = R, then improves the policy greedily.  An action is only replaced
+    when another one beats it by more than the round-off of the linear solve, so the loop stops as
+    soon as no action is clearly better, which usually takes only a few rounds.
+
+    Args:
+        mdp: An instance of the MDP class defined above, describing the environment
+        gamma: the discount factor, must be smaller than 1
+        max_rounds: the number of improvement rounds after which a RuntimeError is raised
+        stats: optional dictionary; if given, the number of rounds taken is stored in
+            stats['rounds']
+
+    Returns:
+        utility: A dictionary mapping state (x, y) tuples to their utility under the policy
+        policy: A dictionary mapping state (x, y) tuples to the optimal action for that state (one
+            of 'up', 'down', 'left', 'right', or None for terminal states)
+    """
+    num_states = len(mdp.states)
+    rows = np.arange(num_states)
+    #start from the policy that is greedy with respect to the rewards
+    pi = _q_values(mdp, mdp.R).argmax(axis=1)
+    for rounds in range(1, max_rounds + 1):
+        #policy evaluation: transition matrix of the current policy, then one linear solve (in
+        #double precision, the system gets ill-conditioned as gamma approaches 1)
+        P_pi = np.zeros((num_states, num_states))
+        np.add.at(P_pi, (rows[:, None], mdp.succ_idx[rows, pi]), mdp.succ_prob[rows, pi])
+        V = np.linalg.solve(np.eye(num_states) - gamma * P_pi, mdp.R.astype(np.float64))
+        #policy improvement: only switch actions that are beaten by more than the solve's
+        #round-off (which grows with the utilities and with 1/(1-gamma)), so near-ties cannot cycle
+        tol = 1e-9 * max(1.0, float(np.abs(V).max())) / (1.0 - gamma)
+        Q = _q_values(mdp, V)
+        best = Q.argmax(axis=1)
+        new_pi = np.where(Q[rows, best] > Q[rows, pi] + tol, best, pi)
+        if np.array_equal(new_pi, pi):
+            break
+        pi = new_pi
+    else:
+        raise RuntimeError("policy_iteration did not converge in {} rounds.".format(max_rounds))
+    if stats is not None:
+        stats['rounds'] = rounds
+
+    return dict(zip(mdp.states, V.tolist())), _policy_dict(mdp, pi)
+
+
+def utils_and_policy(emdeepee, gamma, epsilon, method='value', verbose=False, v_init=None,
+                     stats=None):
     """Calculate the utilities for the states of an MDP and create a policy from
     an MDP and a set of utilities for each state.
 
@@ -191,6 +534,13 @@ def utils_and_policy(emdeepee, gamma, epsilon):
         epsilon: the change threshold to use when determining convergence.  The function returns
             when none of the states have a utility whose change from the previous iteration is more
             than epsilon
+        method: 'value' to use value iteration and derive the policy from its utilities, or
+            'policy' to use policy iteration (which ignores epsilon)
+        verbose: if True, print the utilities and the policy as ascii-art grids
+        v_init: optional starting utilities for value iteration, see value_iteration (policy
+            iteration has no use for them, so they cannot be combined with method='policy')
+        stats: optional dictionary that receives the sweeps (value iteration) or rounds (policy
+            iteration) taken, see value_iteration and policy_iteration
 
     Returns:
         utility: A dictionary mapping state (x, y) tuples to a utility value (perhaps calculated
@@ -201,11 +551,22 @@ def utils_and_policy(emdeepee, gamma, epsilon):
     if emdeepee == None or gamma == None or epsilon == None:
         print("At least one of emdeepee, gamma, or epsilon was None in utils_and_policy.")
         return None, None
-    utilities = value_iteration(emdeepee, gamma, epsilon)
+    if method == 'policy' and v_init is not None:
+        print("v_init only applies to method='value' in utils_and_policy.")
+        return None, None
+    if method == 'policy':
+        utilities, policy = policy_iteration(emdeepee, gamma, stats=stats)
+    elif method == 'value':
+        utilities, policy = value_iteration(emdeepee, gamma, epsilon, with_policy=True,
+                                            v_init=v_init, stats=stats)
+    else:
+        print("Unknown method {!r} in utils_and_policy, use 'value' or 'policy'.".format(method))
+        return None, None
+    if not verbose:
+        return utilities, policy
     try:
         print(ascii_grid_utils(utilities))
         print()
-        policy = derive_policy(emdeepee, utilities)
         print(ascii_grid_policy(policy))
     except:
         if utilities == None:
@@ -242,13 +603,13 @@ def ascii_grid_policy(actions):
 
 def ascii_grid(vals):
     """High-tech helper function for printing out values associated with a 2x3 MDP."""
-    s = ""
-    s += " ________________________________  \n"
-    s += "|          |          |          | \n"
-    s += "| {} | {} | {} | \n".format(vals[(1, 2)], vals[(2, 2)], vals[(3, 2)])
-    s += "|__________|__________|__________| \n"
-    s += "|          |          |          | \n"
-    s += "| {} | {} | {} | \n".format(vals[(1, 1)], vals[(2, 1)], vals[(3, 1)])
-    s += "|__________|__________|__________| \n"
-    return s
+    return "".join([
+        " ________________________________  \n",
+        "|          |          |          | \n",
+        "| {} | {} | {} | \n".format(vals[(1, 2)], vals[(2, 2)], vals[(3, 2)]),
+        "|__________|__________|__________| \n",
+        "|          |          |          | \n",
+        "| {} | {} | {} | \n".format(vals[(1, 1)], vals[(2, 1)], vals[(3, 1)]),
+        "|__________|__________|__________| \n",
+    ])
 
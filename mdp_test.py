@@ -1,90 +1,206 @@
 import mdp
 
-def test1():
+def make_gridworld(penalty, prob_forw):
+    """Return the 2x3 test gridworld with the given reward at (2, 2) and forward probability,
+    with its specialized sweep already compiled.
+    """
     gridworld = mdp.MDP(2, 3,
-                        rewards={(2, 2): -10, (3, 2): 20, (1, 2): -1,
+                        rewards={(2, 2): penalty, (3, 2): 20, (1, 2): -1,
                                  (3, 1): -1, (2, 1): -1, (1, 1): -1},
                         terminals=[(3, 2)],
-                        prob_forw=0.8)
+                        prob_forw=prob_forw)
+    gridworld.compile()
+    return gridworld
+
+
+#(penalty at (2, 2), prob_forw, discount_factor) of tests 1-4
+TEST_GRIDS = [(-10, 0.8, 0.8), (-100, 0.8, 0.8), (-10, 0.5, 0.8), (-10, 0.8, 0.6)]
+
+
+def test1(verbose=False):
+    gridworld = make_gridworld(-10, 0.8)
     epsilon = 0.01
     discount_factor = 0.8
 
-    print("\n", '─' * 50, "\n", "Test 1 Start State")
-    print(mdp.ascii_grid_utils(gridworld.rewards))
-    print("\n", "Rewards With Best Policy")
+    if verbose:
+        print("\n", '─' * 50, "\n", "Test 1 Start State")
+        print(mdp.ascii_grid_utils(gridworld.rewards))
+        print("\n", "Rewards With Best Policy")
+    stats = {}
     utilities, policy = mdp.utils_and_policy(
-        gridworld, discount_factor, epsilon)
+        gridworld, discount_factor, epsilon, verbose=verbose, stats=stats)
 
     return {"gridworld": gridworld, "epsilon": epsilon,
             "discount_factor": discount_factor, "utilities": utilities,
-            "policy": policy}
+            "policy": policy, "sweeps": stats["sweeps"]}
 
 
-def test2():
-    gridworld = mdp.MDP(2, 3,
-                        rewards={(2, 2): -100, (3, 2): 20, (1, 2): -1,
-                                 (3, 1): -1, (2, 1): -1, (1, 1): -1},
-                        terminals=[(3, 2)],
-                        prob_forw=0.8)
+def test2(verbose=False):
+    gridworld = make_gridworld(-100, 0.8)
     epsilon = 0.01
     discount_factor = 0.8
 
-    print("\n", '─' * 50, "\n", "Test 2 Start State")
-    print(mdp.ascii_grid_utils(gridworld.rewards))
-    print("\n", "Rewards With Best Policy")
+    if verbose:
+        print("\n", '─' * 50, "\n", "Test 2 Start State")
+        print(mdp.ascii_grid_utils(gridworld.rewards))
+        print("\n", "Rewards With Best Policy")
+    stats = {}
     utilities, policy = mdp.utils_and_policy(
-        gridworld, discount_factor, epsilon)
+        gridworld, discount_factor, epsilon, verbose=verbose, stats=stats)
 
     return {"gridworld": gridworld, "epsilon": epsilon,
             "discount_factor": discount_factor, "utilities": utilities,
-            "policy": policy}
+            "policy": policy, "sweeps": stats["sweeps"]}
 
 
-def test3():
-    gridworld = mdp.MDP(2, 3,
-                        rewards={(2, 2): -10, (3, 2): 20, (1, 2): -1,
-                                 (3, 1): -1, (2, 1): -1, (1, 1): -1},
-                        terminals=[(3, 2)],
-                        prob_forw=0.5)
+def test3(verbose=False, v_init=None):
+    gridworld = make_gridworld(-10, 0.5)
     epsilon = 0.01
     discount_factor = 0.8
 
-    print("\n", '─' * 50, "\n", "Test 3 Start State")
-    print(mdp.ascii_grid_utils(gridworld.rewards))
-    print("\n", "Rewards With Best Policy")
+    if verbose:
+        print("\n", '─' * 50, "\n", "Test 3 Start State")
+        print(mdp.ascii_grid_utils(gridworld.rewards))
+        print("\n", "Rewards With Best Policy")
+    stats = {}
     utilities, policy = mdp.utils_and_policy(
-        gridworld, discount_factor, epsilon)
+        gridworld, discount_factor, epsilon, verbose=verbose, stats=stats, v_init=v_init)
 
     return {"gridworld": gridworld, "epsilon": epsilon,
             "discount_factor": discount_factor, "utilities": utilities,
-            "policy": policy}
+            "policy": policy, "sweeps": stats["sweeps"]}
 
 
-def test4():
-    gridworld = mdp.MDP(2, 3,
-                        rewards={(2, 2): -10, (3, 2): 20, (1, 2): -1,
-                                 (3, 1): -1, (2, 1): -1, (1, 1): -1},
-                        terminals=[(3, 2)],
-                        prob_forw=0.8)
+def test4(verbose=False, v_init=None):
+    gridworld = make_gridworld(-10, 0.8)
     epsilon = 0.01
     discount_factor = 0.6
 
-    print("\n", '─' * 50, "\n", "Test 4 Start State")
-    print(mdp.ascii_grid_utils(gridworld.rewards))
-    print("\n", "Rewards With Best Policy")
+    if verbose:
+        print("\n", '─' * 50, "\n", "Test 4 Start State")
+        print(mdp.ascii_grid_utils(gridworld.rewards))
+        print("\n", "Rewards With Best Policy")
+    stats = {}
     utilities, policy = mdp.utils_and_policy(
-        gridworld, discount_factor, epsilon)
+        gridworld, discount_factor, epsilon, verbose=verbose, stats=stats, v_init=v_init)
 
     return {"gridworld": gridworld, "epsilon": epsilon,
             "discount_factor": discount_factor, "utilities": utilities,
-            "policy": policy}
+            "policy": policy, "sweeps": stats["sweeps"]}
+
+
+def batch_results(expected, verbose=False):
+    #the four gridworlds above share their shape, so they can be solved in a single batched loop;
+    #the results must match the expected ones of test1-test4
+    gridworlds = [make_gridworld(penalty, prob_forw) for penalty, prob_forw, _ in TEST_GRIDS]
+    epsilon = 0.01
+    discount_factors = [discount_factor for _, _, discount_factor in TEST_GRIDS]
+
+    if verbose:
+        print("\n", '─' * 50, "\n", "Batched Tests 1-4")
+    batch_utilities = mdp.batch_value_iteration(gridworlds, discount_factors, epsilon)
+    results = []
+    for num, (gridworld, discount_factor, utilities) in enumerate(
+            zip(gridworlds, discount_factors, batch_utilities), 1):
+        policy = mdp.derive_policy(gridworld, utilities)
+        if verbose:
+            print("\n", "Test {} Rewards With Best Policy".format(num))
+            print(mdp.ascii_grid_utils(utilities))
+            print(mdp.ascii_grid_policy(policy))
+        #both solves stop within epsilon of a sweep, so each is within
+        #epsilon * gamma / (1 - gamma) of the true utilities
+        tolerance = 2 * epsilon * discount_factor / (1 - discount_factor)
+        assert policy == expected[num - 1]["policy"], num
+        for state in gridworld.get_states():
+            assert abs(utilities[state] - expected[num - 1]["utilities"][state]) <= tolerance, \
+                (num, state)
+        results.append({"gridworld": gridworld, "epsilon": epsilon,
+                        "discount_factor": discount_factor, "utilities": utilities,
+                        "policy": policy})
+    return results
+
+
+def test_batch():
+    batch_results([test1(), test2(), test3(), test4()])
+
+
+def test_warm_start():
+    #tests 3 and 4 warm-started from the utilities of test 1 must give the same results as a
+    #cold start, in no more sweeps
+    test1_results = test1()
+    for test in (test3, test4):
+        cold = test()
+        warm = test(v_init=test1_results["utilities"])
+        tolerance = 2 * cold["epsilon"] * cold["discount_factor"] / (1 - cold["discount_factor"])
+        assert warm["policy"] == cold["policy"], test.__name__
+        for state in cold["gridworld"].get_states():
+            assert abs(warm["utilities"][state] - cold["utilities"][state]) <= tolerance, \
+                (test.__name__, state)
+        assert warm["sweeps"] <= cold["sweeps"], (test.__name__, warm["sweeps"], cold["sweeps"])
+
+    #policy iteration has no use for starting utilities, so they are rejected rather than dropped
+    gridworld = make_gridworld(-10, 0.8)
+    assert mdp.utils_and_policy(gridworld, 0.8, 0.01, method='policy',
+                                v_init=test1_results["utilities"]) == (None, None)
+
+
+def test_policy_iteration():
+    #policy iteration must agree with value iteration run to a tight epsilon on the test grids
+    for penalty, prob_forw, discount_factor in TEST_GRIDS:
+        gridworld = make_gridworld(penalty, prob_forw)
+        utilities, policy = mdp.policy_iteration(gridworld, discount_factor)
+        vi_utilities, vi_policy = mdp.value_iteration(gridworld, discount_factor, 1e-6,
+                                                      with_policy=True)
+        assert policy == vi_policy, (policy, vi_policy)
+        for state in gridworld.get_states():
+            assert abs(utilities[state] - vi_utilities[state]) < 1e-3, state
+
+    #near-tied actions used to make the improvement step flip back and forth forever
+    gridworld = mdp.MDP(4, 2, rewards={(1, 2): 0, (1, 3): 0, (2, 2): 0, (2, 3): -1, (2, 4): -1},
+                        terminals=[], prob_forw=0.5)
+    utilities, policy = mdp.policy_iteration(gridworld, 0.99)
+    vi_utilities = mdp.value_iteration(gridworld, 0.99, 1e-6)
+    for state in gridworld.get_states():
+        assert abs(utilities[state] - vi_utilities[state]) < 1e-3, state
+
+
+def test_symmetry():
+    #a 3x3 grid mirrored around its middle row: solving only the bottom two rows must give the
+    #same utilities and policy as solving the full grid
+    gridworld = mdp.MDP(3, 3, rewards={(3, 2): 10, (2, 1): -5, (2, 3): -5},
+                        terminals=[(3, 2)], prob_forw=0.8, reward_default=-0.5)
+    mirror = lambda state: (state[0], min(state[1], 4 - state[1]))
+    utilities, policy = mdp.value_iteration(gridworld, 0.9, 1e-4, with_policy=True)
+    sym_utilities, sym_policy = mdp.value_iteration(gridworld, 0.9, 1e-4, with_policy=True,
+                                                    symmetry=mirror)
+    assert policy == sym_policy, (policy, sym_policy)
+    for state in gridworld.get_states():
+        assert abs(utilities[state] - sym_utilities[state]) < 1e-3, state
+
+    #mapping states onto ones with a different reward is rejected
+    try:
+        mdp.value_iteration(gridworld, 0.9, 1e-4, symmetry=lambda state: (1, state[1]))
+    except ValueError:
+        pass
+    else:
+        assert False, "a reward-breaking symmetry was accepted"
 
 
 ##########################
 
 if __name__ == "__main__":
-    #test different gridworls
-    test1_results = test1()
+    #test different gridworls, printing the grids of the first one
+    test1_results = test1(verbose=True)
     test2_results = test2()
-    test3_results = test3()
-    test4_results = test4()
+    #test 3 only changes prob_forw and test 4 only the discount factor, so both warm-start
+    #from the utilities of test 1
+    test3_results = test3(v_init=test1_results["utilities"])
+    test4_results = test4(v_init=test1_results["utilities"])
+    print("Sweeps to converge:", [results["sweeps"] for results in
+                                  (test1_results, test2_results, test3_results, test4_results)])
+    #and all of them again in one batched solve, checked against the results above
+    batched_results = batch_results([test1_results, test2_results, test3_results,
+                                     test4_results])
+    test_warm_start()
+    test_policy_iteration()
+    test_symmetry()